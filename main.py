@@ -10,285 +10,537 @@ import math
 import uuid
 import shutil
 import argparse
+import functools
 import json
+import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
+import numpy as np
 import pandas as pd
+import xlsxwriter
 from openpyxl import load_workbook
 # Ensure pandas and openpyxl are installed
 
+# Pre-compiled patterns - compile ครั้งเดียวตอน import แทนที่จะ compile ซ้ำทุก cell
+# logger แบบ lazy - ค่า default WARNING จึงไม่เสีย cost format/encode ตอนรันผ่าน server
+log = logging.getLogger(__name__)
+
+_RE_STRIP = re.compile(r'[,\s]')
+_RE_NONNUM = re.compile(r'[^\d.-]')
+# ตัวอักษร hex สำหรับเช็ค UUID prefix ของชื่อไฟล์แบบ string ตรงๆ (รูปแบบ 8-4-4-4-12 + '_')
+_HEX = frozenset('0123456789abcdef')
+_RE_ONE = re.compile(r'\b1\b')
+_RE_HW = re.compile(r'\bh\s*/\s*w\b', re.IGNORECASE)
+
+# สีที่ไม่ต้องการ (สีใส / Excel theme colors)
+_EXCLUDED_COLORS = frozenset({"00000000", "F2F2F2"})
+
+# จับ thickness label ทุกแบบ (Thk.N / Thickness N / หนา N / ชั้น N / ระดับ N / N เดี่ยวๆ)
+# ใน pass เดียว - ใช้ตอนสแกนคอลัมน์ A หา matrices ทั้งหมดของชีต
+_RE_THK_SCAN = re.compile(r'(?:Thk\.|Thickness\s*|หนา\s*|ชั้น\s*|ระดับ\s*|\b)(\d{1,2})\b', re.IGNORECASE)
+
+# translation table ลบอักขระ ASCII ทุกตัวที่ไม่ใช่ตัวเลข/จุด/ลบ - เร็วกว่า re.sub มาก
+_NUM_KEEP = set('0123456789.-')
+_TRANS_NONNUM = str.maketrans('', '', ''.join(chr(c) for c in range(128) if chr(c) not in _NUM_KEEP))
+
+
+@functools.lru_cache(maxsize=32)
+def _thickness_re(thickness_num):
+    """Compile thickness pattern เป็น alternation เดียว - match ครั้งเดียวต่อ cell แทน 6 ครั้ง"""
+    return re.compile(
+        rf"(?:Thk\.{thickness_num}"
+        rf"|\b{thickness_num}\b"
+        rf"|Thickness\s*{thickness_num}"
+        rf"|หนา\s*{thickness_num}"
+        rf"|ชั้น\s*{thickness_num}"
+        rf"|ระดับ\s*{thickness_num})",
+        re.IGNORECASE,
+    )
+
+
 class ColorExtractor:
     def __init__(self, job_id: str):
         self.job_id = job_id
-        
+        # cache สี RGB ต่อ fill object - openpyxl ใช้ style table ร่วมกันทั้ง workbook
+        self._fill_cache = {}
+        # cache สีต่อ fillId จาก style table - workbook ปกติมี fill ไม่กี่สิบแบบ
+        self._fillid_cache = {}
+        # cache คอลัมน์ A (strip แล้ว) ต่อ DataFrame - finder ถูกเรียกซ้ำหลายสิบครั้งต่อชีต
+        self._col_a_cache = {}
+
+
+    def _col_a_strings(self, raw):
+        """คอลัมน์ A ของชีตแบบ strip แล้ว - แปลงครั้งเดียวต่อชีตแล้วใช้ซ้ำทุก finder"""
+        key = id(raw)
+        cached = self._col_a_cache.get(key)
+        if cached is None:
+            cached = self._col_a_cache[key] = raw.iloc[:, 0].astype('string').str.strip()
+        return cached
+
     def to_number(self, val):
         """Convert value to number, removing commas"""
-        try:
-            if val is None:
-                return None
-            
-            str_val = str(val).strip()
-            # Remove comma, space, and special characters
-            clean_val = re.sub(r'[,\s]', '', str_val)
-            clean_val = re.sub(r'[^\d.-]', '', clean_val)
-            
-            if not clean_val or clean_val in ['', '-', '.']:
+        if val is None:
+            return None
+
+        # fast path: เปิดไฟล์ด้วย data_only=True ค่าตัวเลขส่วนใหญ่มาเป็น int/float อยู่แล้ว
+        # ไม่ต้องแปลงเป็น string แล้ว strip/translate (bool เป็น subclass ของ int - คงผลเดิมคือ None)
+        if isinstance(val, bool):
+            return None
+        if isinstance(val, int):
+            return val
+        if isinstance(val, float):
+            if math.isnan(val):
                 return None
-                
+            return int(val) if val.is_integer() else val
+
+        str_val = str(val).strip()
+        # Remove comma, space, and special characters ด้วย translation table
+        clean_val = str_val.translate(_TRANS_NONNUM)
+        if not clean_val.isascii():
+            # เหลืออักขระ non-ASCII (เช่น ข้อความไทย) - ลบด้วย regex เหมือนเดิม
+            clean_val = _RE_NONNUM.sub('', clean_val)
+
+        if not clean_val or clean_val in ['', '-', '.']:
+            return None
+
+        # จำกัด except ไว้แค่จุดที่ parse จริงๆ - ไม่ต้องตั้ง exception frame
+        # ครอบทั้งฟังก์ชันในทุก call (และไม่กลืน error จริงจาก path อื่น)
+        try:
             f = float(clean_val)
-            if math.isnan(f):
-                return None
-            return int(f) if f.is_integer() else f
-        except:
+        except ValueError:
             return None
+        if math.isnan(f):
+            return None
+        return int(f) if f.is_integer() else f
+
+    def to_number_series(self, s):
+        """to_number แบบ vectorized ทั้ง Series - คืน float64 (NaN = แปลงไม่ได้)
+
+        ใช้ string-cleaning ชุดเดียวกับ to_number (ตัด comma/ช่องว่าง แล้วตัด
+        อักขระที่ไม่ใช่ตัวเลข) แต่รันใน pandas C-loop รอบเดียวแทน interpreter
+        ต่อเซลล์ - เหมาะกับ block ตัวเลขล้วนอย่าง price matrix
+        """
+        cleaned = (s.astype('string')
+                    .str.replace(_RE_STRIP, '', regex=True)
+                    .str.replace(_RE_NONNUM, '', regex=True)
+                    .replace({'': None, '-': None, '.': None}))
+        nums = pd.to_numeric(cleaned, errors='coerce')
+
+        # pd.to_numeric ไม่รับเลข Unicode (เช่นเลขไทย ๕๐๐) ที่ float()/to_number
+        # รับได้ - ตัวที่ถูก coerce เป็น NaN ทั้งที่ string หลัง clean ไม่ว่าง
+        # ให้ย้อนไป parse แบบ scalar เพื่อให้สองเส้นทางได้ผลตรงกัน
+        retry = nums.isna() & cleaned.notna()
+        if retry.any():
+            nums = nums.astype('float64')
+            nums[retry] = [self.to_number(v) for v in s[retry]]
+        return nums
+
+    def cell_color(self, cell):
+        """สี RGB ของเซลล์ - memoize ด้วย fillId จาก style table ของ workbook
+
+        ทุกเซลล์ที่ style เหมือนกันชี้ fillId เดียวกัน จึง hit cache ได้โดยไม่ต้อง
+        resolve cell.fill (ซึ่ง lookup style table ทุกครั้ง) ซ้ำ key set เล็กมาก
+        เพราะ workbook ทั่วไปมี fill ไม่ถึงร้อยแบบ (EmptyCell ไม่มี style_array -
+        ตกไปใช้ normalize_rgb(None) เหมือนเดิม)
+        """
+        sa = getattr(cell, 'style_array', None)
+        if sa is None:
+            return self.normalize_rgb(getattr(cell, 'fill', None))
+        fill_id = sa.fillId
+        cached = self._fillid_cache.get(fill_id)
+        if cached is None:
+            cached = self._fillid_cache[fill_id] = self.normalize_rgb(cell.fill)
+        return cached
 
     def normalize_rgb(self, fill):
         """Convert ARGB color to RGB hex format - แก้ไขให้อ่านสีที่ถูกต้อง"""
         if not fill:
             return "FFFFFF"
-        
+
+        # หลายเซลล์ใช้ Fill object เดียวกันผ่าน shared style table
+        # จึง parse แค่ครั้งเดียวต่อ fill แล้ว cache ผลไว้
+        key = id(fill)
+        cached = self._fill_cache.get(key)
+        if cached is None:
+            cached = self._fill_cache[key] = self._normalize_rgb_uncached(fill)
+        return cached
+
+    def _normalize_rgb_uncached(self, fill):
         # ตรวจสอบ patternType ก่อน - เฉพาะ solid fill เท่านั้น
-        if hasattr(fill, 'patternType') and fill.patternType:
-            pattern_value = fill.patternType.value if hasattr(fill.patternType, 'value') else str(fill.patternType)
-            # ถ้าไม่ใช่ solid pattern ให้ถือว่าไม่มีสี
-            if pattern_value != 'solid':
-                return "FFFFFF"
-        else:
-            # ถ้าไม่มี patternType ให้ถือว่าไม่มีสี
+        # (getattr ตรงๆ แทน hasattr chain - ฟังก์ชันนี้ถูกเรียกต่อเซลล์)
+        pt = getattr(fill, 'patternType', None)
+        if pt is None or getattr(pt, 'value', pt) != 'solid':
+            # ถ้าไม่มี patternType หรือไม่ใช่ solid pattern ให้ถือว่าไม่มีสี
             return "FFFFFF"
-        
-        # รายการสีที่ไม่ต้องการ (Excel theme colors) - ไม่รวม 92CDDC
-        excluded_colors = [
-            "00000000",  # สีใส
-            "F2F2F2"
-        ]
-        
+
         color_found = ""
-        
+
         # Check fgColor
-        if hasattr(fill, 'fgColor') and fill.fgColor:
-            if hasattr(fill.fgColor, 'rgb') and fill.fgColor.rgb:
-                color_str = str(fill.fgColor.rgb).upper()
-                if color_str == "00000000":
-                    return "FFFFFF"
-                elif len(color_str) == 8:
-                    color_found = color_str[2:]
-                elif len(color_str) == 6:
-                    color_found = color_str
-        
+        rgb = getattr(getattr(fill, 'fgColor', None), 'rgb', None)
+        if rgb:
+            color_str = str(rgb).upper()
+            if color_str == "00000000":
+                return "FFFFFF"
+            elif len(color_str) == 8:
+                color_found = color_str[2:]
+            elif len(color_str) == 6:
+                color_found = color_str
+
         # Check bgColor
-        if not color_found and hasattr(fill, 'bgColor') and fill.bgColor:
-            if hasattr(fill.bgColor, 'rgb') and fill.bgColor.rgb:
-                color_str = str(fill.bgColor.rgb).upper()
+        if not color_found:
+            rgb = getattr(getattr(fill, 'bgColor', None), 'rgb', None)
+            if rgb:
+                color_str = str(rgb).upper()
                 if color_str == "00000000":
                     return "FFFFFF"
                 elif len(color_str) == 8:
                     color_found = color_str[2:]
                 elif len(color_str) == 6:
                     color_found = color_str
-        
-        # ตรวจสอบว่าเป็นสีที่ไม่ต้องการหรือไม่
-        if color_found in excluded_colors:
+
+        # ตรวจสอบว่าเป็นสีที่ไม่ต้องการหรือไม่ (Excel theme colors) - ไม่รวม 92CDDC
+        if color_found in _EXCLUDED_COLORS:
             return "FFFFFF"
-        
+
         return color_found if color_found else "FFFFFF"
 
     def find_thickness_matrix_in_column_a(self, ws, raw, thickness_num):
         """Find matrix with specific thickness label - หาจากคอลัมน์ A เท่านั้น"""
-        thickness_patterns = [
-            rf"Thk\.{thickness_num}",
-            rf"\b{thickness_num}\b",
-            rf"Thickness\s*{thickness_num}",
-            rf"หนา\s*{thickness_num}",
-            rf"ชั้น\s*{thickness_num}",
-            rf"ระดับ\s*{thickness_num}"
-        ]
-        
-        # หา thickness header ในคอลัมน์ A เท่านั้น (column index 0)
-        for r in range(raw.shape[0]):
-            if raw.shape[1] > 0:  # ตรวจสอบว่ามีคอลัมน์ A
-                cell_val = str(raw.iat[r, 0]).strip() if raw.iat[r, 0] is not None else ""
-                for pattern in thickness_patterns:
-                    if re.search(pattern, cell_val, re.IGNORECASE):
-                        print(f"   ✅ พบ {thickness_num} matrix ที่ row={r+1}, col=A (คอลัมน์ A)")
-                        return r
-        
+        if raw.shape[1] == 0:  # ตรวจสอบว่ามีคอลัมน์ A
+            return None
+
+        # หา thickness header ในคอลัมน์ A เท่านั้น (column index 0) - vectorized ทั้งคอลัมน์ทีเดียว
+        col_a = self._col_a_strings(raw)
+        mask = col_a.str.contains(_thickness_re(thickness_num), na=False, regex=True)
+        if mask.any():
+            r = int(mask.to_numpy().argmax())
+            log.info("   ✅ พบ %s matrix ที่ row=%d, col=A (คอลัมน์ A)", thickness_num, r + 1)
+            return r
+
         return None
 
     def find_main_matrix(self, ws, raw):
         """Find main matrix (1 or h/w header) - หา 1 จากคอลัมน์ A, h/w จากทั่วไป"""
-        # หาจาก 1 header ในคอลัมน์ A เท่านั้น
-        for r in range(raw.shape[0]):
-            if raw.shape[1] > 0:  # ตรวจสอบว่ามีคอลัมน์ A
-                cell_val = str(raw.iat[r, 0]).strip() if raw.iat[r, 0] is not None else ""
-                # หา 1 header ในคอลัมน์ A
-                if re.search(r"\b1\b", cell_val, re.IGNORECASE):
-                    print(f"   ✅ พบ 1 matrix (main) ที่ row={r+1}, col=A (คอลัมน์ A)")
-                    return r, 0  # ส่งคืน column = 0 (คอลัมน์ A)
+        # หาจาก 1 header ในคอลัมน์ A เท่านั้น - vectorized ทั้งคอลัมน์ทีเดียว
+        if raw.shape[1] > 0:  # ตรวจสอบว่ามีคอลัมน์ A
+            col_a = self._col_a_strings(raw)
+            mask = col_a.str.contains(_RE_ONE, na=False, regex=True)
+            if mask.any():
+                r = int(mask.to_numpy().argmax())
+                log.info("   ✅ พบ 1 matrix (main) ที่ row=%d, col=A (คอลัมน์ A)", r + 1)
+                return r, 0  # ส่งคืน column = 0 (คอลัมน์ A)
         
         # ถ้าไม่พบ 1 header ให้หา h/w header แทน (ค้นหาทั่วไป - backward compatibility)
-        for r in range(raw.shape[0]):
-            for c in range(raw.shape[1]):
-                if raw.iat[r, c] is None:
-                    continue
-                if isinstance(raw.iat[r, c], str):
-                    if re.search(r"\bh\s*/\s*w\b", raw.iat[r, c], re.IGNORECASE):
-                        print(f"   ✅ พบ h/w matrix (fallback) ที่ row={r+1}, col={c+1}")
-                        return r, c
-        
+        # สแกนทั้ง frame ใน pass เดียวด้วย pandas C-loop แทน re.search ต่อเซลล์
+        # (argwhere คืน row-major - ตัวแรกที่เจอตรงกับลำดับ loop เดิม)
+        mask = (raw.astype('string')
+                   .apply(lambda s: s.str.contains(_RE_HW, na=False, regex=True))
+                   .to_numpy())
+        hits = np.argwhere(mask)
+        if hits.size:
+            r, c = int(hits[0, 0]), int(hits[0, 1])
+            log.info("   ✅ พบ h/w matrix (fallback) ที่ row=%d, col=%d", r + 1, c + 1)
+            return r, c
+
         return None, None
 
     def read_color_matrix_with_thickness_row(self, ws, raw, hr_main, hc_main, hr_thick, widths, heights, matrix_name=""):
         """อ่านสีจาก thickness row โดยใช้ position ของ main matrix"""
-        print(f"     🔍 {matrix_name}: อ่านสีจาก thickness row {hr_thick+1}")
-        print(f"     📍 Main matrix: row={hr_main+1}, col={hc_main+1}")
-        print(f"     📍 Thickness header: row={hr_thick+1}, col=A")
-        
-        colors = {}
+        log.info("     🔍 %s: อ่านสีจาก thickness row %d", matrix_name, hr_thick + 1)
+        log.info("     📍 Main matrix: row=%d, col=%d", hr_main + 1, hc_main + 1)
+        log.info("     📍 Thickness header: row=%d, col=A", hr_thick + 1)
         
-        # ลอง offset หลายแบบเหมือนฟังก์ชัน auto-offset เดิม
+        # ดึง rectangle ที่ครอบคลุมทุก offset ที่จะลอง ด้วย iter_rows ครั้งเดียว
+        # แทนการเรียก ws.cell ทีละเซลล์ (ws.cell ช้าเพราะสร้าง object ต่อ call)
+        # clamp ด้วยขนาดของ raw - read-only sheet ที่ไม่มี <dimension> record
+        # จะให้ ws.max_row/max_column เป็น None แต่ raw ครอบข้อมูลจริงทั้งหมดแล้ว
+        grid_min_row = hr_thick + 1
+        grid_min_col = hc_main + 1
+        grid_max_row = min(hr_thick + 3 + len(heights) - 1, raw.shape[0])
+        grid_max_col = min(hc_main + 3 + len(widths) - 1, raw.shape[1])
+        color_grid = []
+        if grid_max_row >= grid_min_row and grid_max_col >= grid_min_col:
+            for row in ws.iter_rows(min_row=grid_min_row, max_row=grid_max_row,
+                                    min_col=grid_min_col, max_col=grid_max_col):
+                color_grid.append([self.cell_color(cell) for cell in row])
+
+        def grid_color(excel_row, excel_col):
+            gr = excel_row - grid_min_row
+            gc = excel_col - grid_min_col
+            if 0 <= gr < len(color_grid) and 0 <= gc < len(color_grid[gr]):
+                return color_grid[gr][gc]
+            return "FFFFFF"
+
+        # เลือก offset ด้วย sliding window บน coloredness array แทน nested loop 9 offsets
+        # ทดสอบเฉพาะ block min(2,H) x min(2,W) แรกเหมือนเดิม
         best_colors = {}
-        max_valid_colors = 0
-        best_offset = (1, 1)
-        
-        # ลอง offset ต่างๆ โดยเริ่มจาก thickness row
-        for row_offset in [1, 2, 3]:
-            for col_offset in [1, 2, 3]:
-                test_colors = {}
-                valid_count = 0
-                
-                # ทดสอบเฉพาะ 4 เซลล์แรก
-                for i_h in range(min(2, len(heights))):
-                    for i_w in range(min(2, len(widths))):
-                        h, w = heights[i_h], widths[i_w]
-                        try:
-                            # เริ่มจาก thickness row + offset
-                            excel_row = hr_thick + row_offset + i_h
-                            excel_col = hc_main + col_offset + i_w  # ใช้ col ของ main matrix
-                            
-                            if excel_row <= ws.max_row and excel_col <= ws.max_column:
-                                cell = ws.cell(row=excel_row, column=excel_col)
-                                color = self.normalize_rgb(cell.fill)
-                                test_colors[(h, w)] = color
-                                if color != "FFFFFF":
-                                    valid_count += 1
-                            else:
-                                test_colors[(h, w)] = "FFFFFF"
-                        except Exception as e:
-                            test_colors[(h, w)] = "FFFFFF"
-                
-                # ถ้า offset นี้ให้ผลดีกว่า
-                if valid_count > max_valid_colors:
-                    max_valid_colors = valid_count
-                    best_offset = (row_offset, col_offset)
-                    print(f"       🎯 offset +{row_offset},+{col_offset}: {valid_count} สี")
-        
-        # ใช้ offset ที่ดีที่สุดเพื่ออ่านทั้ง matrix
-        row_offset, col_offset = best_offset
-        print(f"     ✅ ใช้ offset สำหรับ {matrix_name}: +{row_offset},+{col_offset}")
-        
+        th = min(2, len(heights))
+        tw = min(2, len(widths))
+        probe = np.zeros((2 + th, 2 + tw), dtype=np.int8)
+        for gr in range(min(probe.shape[0], len(color_grid))):
+            grid_row = color_grid[gr]
+            for gc in range(min(probe.shape[1], len(grid_row))):
+                if grid_row[gc] != "FFFFFF":
+                    probe[gr, gc] = 1
+
+        # sums[ro-1, co-1] = จำนวนสีของ offset (ro, co) - argmax คืนตัวแรกที่มากสุด
+        # ตรงกับ logic เดิมที่อัพเดทเฉพาะเมื่อดีกว่าอย่างเคร่งครัด
+        sums = np.lib.stride_tricks.sliding_window_view(probe, (th, tw)).sum(axis=(-1, -2))
+        best_idx = np.unravel_index(sums.argmax(), sums.shape)
+        row_offset, col_offset = int(best_idx[0]) + 1, int(best_idx[1]) + 1
+        log.info("     ✅ ใช้ offset สำหรับ %s: +%d,+%d", matrix_name, row_offset, col_offset)
+
         for i_h, h in enumerate(heights):
             for i_w, w in enumerate(widths):
-                try:
-                    excel_row = hr_thick + row_offset + i_h
-                    excel_col = hc_main + col_offset + i_w
-                    
-                    if excel_row <= ws.max_row and excel_col <= ws.max_column:
-                        cell = ws.cell(row=excel_row, column=excel_col)
-                        color = self.normalize_rgb(cell.fill)
-                        best_colors[(h, w)] = color
-                    else:
-                        best_colors[(h, w)] = "FFFFFF"
-                except:
-                    best_colors[(h, w)] = "FFFFFF"
+                best_colors[(h, w)] = grid_color(hr_thick + row_offset + i_h,
+                                                 hc_main + col_offset + i_w)
         
         # แสดงผลสรุป
         colored_count = sum(1 for color in best_colors.values() if color != "FFFFFF")
-        print(f"     📊 {matrix_name}: อ่านได้ {colored_count}/{len(best_colors)} เซลล์ที่มีสี")
+        log.info("     📊 %s: อ่านได้ %d/%d เซลล์ที่มีสี", matrix_name, colored_count, len(best_colors))
         
         return best_colors
 
     def read_color_matrix(self, ws, raw, hr, hc, widths, heights):
         """Read colors from matrix - ใช้ offset มาตรฐาน"""
         color_map = {}
-        
+
+        # ดึงทั้ง rectangle ด้วย iter_rows ครั้งเดียว แทน ws.cell ทีละเซลล์
+        # (ขอบเขตจาก raw ไม่ใช่ ws.max_row - อันหลังเป็น None ได้ใน read-only mode)
+        max_row = min(hr + 1 + len(heights), raw.shape[0])
+        max_col = min(hc + 1 + len(widths), raw.shape[1])
+        rows = []
+        if max_row >= hr + 2 and max_col >= hc + 2:
+            rows = list(ws.iter_rows(min_row=hr + 2, max_row=max_row,
+                                     min_col=hc + 2, max_col=max_col))
+
         for i_h, h in enumerate(heights):
             for i_w, w in enumerate(widths):
-                try:
-                    excel_row = hr + 2 + i_h
-                    excel_col = hc + 2 + i_w
-                    
-                    cell = ws.cell(row=excel_row, column=excel_col)
-                    color = self.normalize_rgb(cell.fill)
-                    color_map[(h, w)] = color
-                except Exception:
+                if i_h < len(rows) and i_w < len(rows[i_h]):
+                    color_map[(h, w)] = self.cell_color(rows[i_h][i_w])
+                else:
                     color_map[(h, w)] = "FFFFFF"
-                    continue
-        
+
         return color_map
 
-    def scan_all_matrices_in_file(self, xls, wb):
+    def scan_all_matrices_in_file(self, wb):
         """สแกนทุกชีตเพื่อหาจำนวน matrix สูงสุด"""
         max_matrices = 1  # อย่างน้อยต้องมี matrix 1
         max_sheet = ""
         all_sheet_matrices = {}
-        
-        print("\n🔍 สแกนทุกชีตเพื่อหาจำนวน matrix...")
-        
-        for sheet_name in xls.sheet_names:
+        raw_by_sheet = {}  # cache DataFrame ต่อชีต ไม่ต้อง parse XML ซ้ำใน process_file
+        thk_rows_by_sheet = {}  # แถวของ thickness header ต่อชีต - process_sheet ใช้ lookup ตรงๆ
+
+        log.info("\n🔍 สแกนทุกชีตเพื่อหาจำนวน matrix...")
+
+        for sheet_name in wb.sheetnames:
             if sheet_name.strip().lower() == "สารบัญ":
                 continue
-                
-            print(f"   📋 สแกน Sheet: {sheet_name}")
-            
+
+            log.info("   📋 สแกน Sheet: %s", sheet_name)
+
             try:
-                raw = pd.read_excel(xls, sheet_name=sheet_name, header=None, engine="openpyxl")
+                # สร้าง grid จาก workbook ที่เปิดไว้แล้วโดยตรง - ชีตถูก parse รอบเดียว
+                # ไม่ต้องให้ pandas แตก zip/XML ไฟล์เดิมซ้ำอีกรอบผ่าน read_excel
                 ws = wb[sheet_name]
+                raw = pd.DataFrame(ws.values)
+                raw_by_sheet[sheet_name] = raw
                 
                 # หา main matrix
                 hr, hc = self.find_main_matrix(ws, raw)
                 if hr is None:
-                    print(f"      ❌ ไม่พบ main matrix ใน {sheet_name}")
+                    log.info("      ❌ ไม่พบ main matrix ใน %s", sheet_name)
                     all_sheet_matrices[sheet_name] = []
                     continue
                 
-                # หา matrices ทั้งหมดในชีตนี้
+                # หา matrices ทั้งหมดในชีตนี้ - เดินคอลัมน์ A รอบเดียว
+                # เก็บทุก thickness label แทนการ re-scan คอลัมน์ 18 รอบ (thickness 2..19)
                 found_matrices = [1]  # 1 เป็น main matrix เสมอ
-                
+                thickness_rows = {}
+                if raw.shape[1] > 0:
+                    for r, val in enumerate(raw.iloc[:, 0].astype('string').str.strip().tolist()):
+                        if val is pd.NA or not val:
+                            continue
+                        for m in _RE_THK_SCAN.finditer(val):
+                            n = int(m.group(1))
+                            if 2 <= n < 20 and n not in thickness_rows:
+                                thickness_rows[n] = r
+
                 for thickness in range(2, 20):  # ตรวจหาสูงสุด 20 matrices
-                    hr_thick = self.find_thickness_matrix_in_column_a(ws, raw, thickness)
-                    if hr_thick is not None:
+                    if thickness in thickness_rows:
                         found_matrices.append(thickness)
-                        print(f"      ✅ พบ matrix {thickness}")
+                        log.info("      ✅ พบ matrix %s", thickness)
                     else:
                         # ถ้าไม่เจอ matrix ลำดับถัดไป ให้หยุดค้นหา
                         break
                 
                 all_sheet_matrices[sheet_name] = found_matrices
+                thk_rows_by_sheet[sheet_name] = thickness_rows
                 matrix_count = len(found_matrices)
-                print(f"      📊 รวม {matrix_count} matrices: {found_matrices}")
+                log.info("      📊 รวม %d matrices: %s", matrix_count, found_matrices)
                 
                 # อัพเดทจำนวน matrix สูงสุด
                 if matrix_count > max_matrices:
                     max_matrices = matrix_count
                     max_sheet = sheet_name
-                    print(f"      🏆 ชีต {sheet_name} มี matrix เยอะที่สุด: {matrix_count} matrices")
+                    log.info("      🏆 ชีต %s มี matrix เยอะที่สุด: %d matrices", sheet_name, matrix_count)
                     
             except Exception as e:
-                print(f"      ❌ Error สแกน {sheet_name}: {e}")
+                log.warning("      ❌ Error สแกน %s: %s", sheet_name, e)
                 all_sheet_matrices[sheet_name] = []
         
-        print(f"\n🎯 ผลการสแกน:")
-        print(f"   🏆 ชีตที่มี matrix เยอะที่สุด: {max_sheet} ({max_matrices} matrices)")
-        print(f"   📋 รายละเอียดทุกชีต:")
+        log.info("\n🎯 ผลการสแกน:")
+        log.info("   🏆 ชีตที่มี matrix เยอะที่สุด: %s (%d matrices)", max_sheet, max_matrices)
+        log.info("   📋 รายละเอียดทุกชีต:")
         for sheet, matrices in all_sheet_matrices.items():
             if matrices:
-                print(f"      - {sheet}: {len(matrices)} matrices {matrices}")
+                log.info("      - %s: %d matrices %s", sheet, len(matrices), matrices)
             else:
-                print(f"      - {sheet}: ไม่พบ matrix")
-        
-        return max_matrices, all_sheet_matrices
+                log.info("      - %s: ไม่พบ matrix", sheet)
+
+        return max_matrices, all_sheet_matrices, raw_by_sheet, thk_rows_by_sheet
+
+    def process_sheet(self, raw, ws, sheet, base_name, max_matrices_count, available_matrices,
+                      thickness_rows=None):
+        """ประมวลผลชีตเดียว - คืนผลลัพธ์โดยยังไม่ใส่ ID (process หลักใส่เรียงลำดับเอง)"""
+        # Find Glass_QTY and Description
+        # lower ทั้ง frame ใน pass เดียวด้วย pandas C-loop แล้วหาตำแหน่ง label
+        # ด้วย np.argwhere แทน nested loop ต่อเซลล์ (argwhere คืน row-major
+        # เหมือนลำดับ loop เดิม - ตัวสุดท้ายชนะเหมือนเดิม)
+        sheet_glass_qty = 1
+        sheet_description = ""
+
+        if raw.shape[1] > 1:
+            low = (raw.astype('string')
+                      .apply(lambda col: col.str.strip().str.lower())
+                      .fillna('')
+                      .to_numpy())
+            labels = low[:, :-1]
+
+            for r, c in np.argwhere((labels == 'glass_qty') | (labels == 'glass qty')):
+                qty = self.to_number(raw.iat[r, c + 1])
+                if qty is not None:
+                    sheet_glass_qty = qty
+
+            for r, c in np.argwhere(labels == 'description'):
+                desc = raw.iat[r, c + 1]
+                if desc is not None:
+                    sheet_description = str(desc).strip()
+
+        # Find main matrix (1 or h/w header)
+        hr, hc = self.find_main_matrix(ws, raw)
+
+        if hr is None or hc is None:
+            error_msg = "ไม่พบ main matrix"
+            log.info("   ❌ %s ใน %s", error_msg, sheet)
+            return {"skip_reason": error_msg}
+
+        # Read widths and heights from main matrix - แปลงทั้งแถว/คอลัมน์ทีเดียว
+        # แล้วหา NaN ตัวแรกด้วย argmax (C-loop) แทน Python loop ที่ break ทีละเซลล์
+        row_vals = self.to_number_series(raw.iloc[hr, hc + 1:]).to_numpy(dtype='float64')
+        row_nan = np.isnan(row_vals)
+        n_widths = int(row_nan.argmax()) if row_nan.any() else len(row_vals)
+        widths = [int(v) if v.is_integer() else float(v) for v in row_vals[:n_widths]]
+
+        col_vals = self.to_number_series(raw.iloc[hr + 1:, hc]).to_numpy(dtype='float64')
+        col_nan = np.isnan(col_vals)
+        n_heights = int(col_nan.argmax()) if col_nan.any() else len(col_vals)
+        heights = [int(v) if v.is_integer() else float(v) for v in col_vals[:n_heights]]
+
+        if not widths or not heights:
+            error_msg = "ไม่พบ dimensions (ความกว้าง/ความสูง)"
+            log.info("   ❌ %s ใน %s", error_msg, sheet)
+            return {"skip_reason": error_msg}
+
+        log.info("   📊 Dimensions: %d heights x %d widths", len(heights), len(widths))
+        log.info("   🎯 Matrices ในชีตนี้: %s", available_matrices)
+
+        # อ่านสีจาก matrices ที่มี
+        matrix_colors = {}
+
+        # อ่าน matrix 1 (main matrix)
+        if 1 in available_matrices:
+            matrix_colors[1] = self.read_color_matrix(ws, raw, hr, hc, widths, heights)
+            log.info("   🎨 1 (main matrix): %d colors", len(matrix_colors[1]))
+
+        # อ่าน matrices อื่นๆ
+        for thickness in available_matrices:
+            if thickness == 1:
+                continue  # ข้าม matrix 1 เพราะอ่านไปแล้ว
+
+            # ใช้แถวที่จำไว้จากรอบสแกน - ไม่ต้องเดินคอลัมน์ A ใหม่ต่อ thickness
+            if thickness_rows is not None:
+                hr_thick = thickness_rows.get(thickness)
+            else:
+                hr_thick = self.find_thickness_matrix_in_column_a(ws, raw, thickness)
+            if hr_thick is not None:
+                colors = self.read_color_matrix_with_thickness_row(
+                    ws, raw, hr, hc, hr_thick, widths, heights, f"{thickness}"
+                )
+                matrix_colors[thickness] = colors
+                log.info("   🎨 %s: %d colors อ่านได้", thickness, len(colors))
+
+        # Create Type record (ยังไม่มี ID)
+        type_row = {
+            "Serie": base_name,
+            "Type": sheet.strip(),
+            "Description": sheet_description,
+            "width_min": min(widths),
+            "width_max": max(widths),
+            "height_min": min(heights),
+            "height_max": max(heights),
+        }
+
+        # Create Price records with consistent columns
+        # แปลง price block ของ main matrix ทั้งก้อนแบบ vectorized (NaN = เซลล์ไม่ใช่ตัวเลข)
+        # แทนการเรียก to_number ทีละเซลล์ในลูป
+        price_block = (raw.iloc[hr + 1:hr + 1 + len(heights),
+                                hc + 1:hc + 1 + len(widths)]
+                          .apply(self.to_number_series)
+                          .to_numpy(dtype='float64'))
+
+        cols = {c: [] for c in
+                ("Serie", "Type", "Width", "Height", "Price", "Glass_QTY",
+                 *(f"{i}_Color" for i in range(1, max_matrices_count + 1)))}
+
+        sheet_price_count = 0
+        for i_h, h in enumerate(heights):
+            block_row = price_block[i_h]
+            for i_w, w in enumerate(widths):
+                # อ่านราคาจาก main matrix (1) - NaN คือเซลล์ที่แปลงไม่ได้
+                p = block_row[i_w]
+                if p != p:
+                    continue
+                p = int(p) if p.is_integer() else p
+
+                # สร้าง price record พร้อมคอลัมน์ตามมาตรฐาน - append ลง column arrays
+                cols["Serie"].append(base_name)
+                cols["Type"].append(sheet.strip())
+                cols["Width"].append(w)
+                cols["Height"].append(h)
+                cols["Price"].append(p)
+                cols["Glass_QTY"].append(sheet_glass_qty)
+
+                # เพิ่มคอลัมน์สีทุกคอลัมน์ตามมาตรฐาน (เติม FFFFFF ถ้าไม่มี)
+                for i in range(1, max_matrices_count + 1):
+                    colors = matrix_colors.get(i)
+                    if colors is not None:
+                        color_value = colors.get((h, w), "FFFFFF")
+                    else:
+                        color_value = "FFFFFF"  # ไม่มี matrix นี้ในชีตนี้
+                    cols[f"{i}_Color"].append(color_value)
+
+                sheet_price_count += 1
+
+        log.info("   ✅ สร้าง %d price records สำหรับ %s", sheet_price_count, sheet)
+
+        return {
+            "skip_reason": None,
+            "type_row": type_row,
+            "price_cols": cols,
+            "count": sheet_price_count,
+        }
 
     def process_file(self, input_file: str, output_dir: str, original_filename: str = None):
         """Process the Excel file"""
@@ -298,205 +550,155 @@ class ColorExtractor:
             else:
                 base_name = os.path.splitext(os.path.basename(input_file))[0]
                 # ลบ UUID ออกจากชื่อไฟล์ (UUID format: 8-4-4-4-12 characters)
-                uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_'
-                base_name = re.sub(uuid_pattern, '', base_name)
+                # prefix UUID มีความยาวและตำแหน่ง dash ตายตัว - เช็คเป็น string ตรงๆ ไม่ต้องใช้ regex
+                if (len(base_name) >= 37 and base_name[36] == '_'
+                        and base_name[8] == base_name[13] == base_name[18] == base_name[23] == '-'
+                        and all(c in _HEX for i, c in enumerate(base_name[:36])
+                                if i not in (8, 13, 18, 23))):
+                    base_name = base_name[37:]
             
-            xls = pd.ExcelFile(input_file, engine="openpyxl")
-            wb = load_workbook(input_file, data_only=True)
+            # read_only=True stream cells แทนการสร้าง DOM ทั้ง workbook - ลดเวลาเปิดไฟล์และ memory มาก
+            # (pipeline นี้อ่านค่า + fill อย่างเดียว และอ่านผ่าน iter_rows อยู่แล้ว)
+            wb = load_workbook(input_file, data_only=True, read_only=True, keep_links=False)
+            self._fill_cache.clear()  # cache ผูกกับ workbook เดิม - ล้างทุกครั้งที่เปิดไฟล์ใหม่
+            self._fillid_cache.clear()
+            self._col_a_cache.clear()
             
             # สแกนทุกชีตเพื่อหาจำนวน matrix สูงสุด
-            max_matrices_count, all_sheet_matrices = self.scan_all_matrices_in_file(xls, wb)
+            (max_matrices_count, all_sheet_matrices,
+             raw_by_sheet, thk_rows_by_sheet) = self.scan_all_matrices_in_file(wb)
             
             # สร้าง template คอลัมน์ตามจำนวน matrix สูงสุด
             matrix_columns = []
             for i in range(1, max_matrices_count + 1):
                 matrix_columns.append(f"{i}_Color")
             
-            print(f"\n📝 จะสร้างคอลัมน์: {matrix_columns}")
+            log.info("\n📝 จะสร้างคอลัมน์: %s", matrix_columns)
             
-            price_rows = []
-            type_rows = []
+            # Ensure output directory exists
+            output_path = Path(output_dir)
+            output_path.mkdir(exist_ok=True)
+
+            price_file = output_path / f"Price_{self.job_id}.xlsx"
+            type_file = output_path / f"Type_{self.job_id}.xlsx"
+
+            # stream record ลงไฟล์ทีละแถวด้วย xlsxwriter โหมด constant_memory
+            # แทนการสะสม list + DataFrame ทั้งก้อนใน RAM ก่อนเขียน - memory คงที่
+            # ไม่ขึ้นกับจำนวน record (เขียนแถวเรียงลำดับเสมอ จึงใช้โหมดนี้ได้
+            # ต่างจากตอนเขียนผ่าน pandas ที่เขียนทีละคอลัมน์)
+            price_wb = xlsxwriter.Workbook(str(price_file), {'constant_memory': True})
+            price_ws = price_wb.add_worksheet()
+            price_ws.write_row(0, 0, ("ID", "Serie", "Type", "Width", "Height",
+                                      "Price", "Glass_QTY", *matrix_columns))
+
+            type_wb = xlsxwriter.Workbook(str(type_file), {'constant_memory': True})
+            type_ws = type_wb.add_worksheet()
+            type_ws.write_row(0, 0, ("ID", "Serie", "Type", "Description",
+                                     "width_min", "width_max", "height_min", "height_max"))
+
             price_id = 1
             type_id = 1
-            
+
             # Track processing results
             processed_sheets = 0
             skipped_sheets = []
             warnings = []
             
-            for sheet in xls.sheet_names:
+            # ชีตข้อมูลที่จะประมวลผลจริง (ไม่ใช่สารบัญ และสแกนเจอ matrix)
+            data_sheets = [s for s in wb.sheetnames
+                           if s.strip().lower() != "สารบัญ" and all_sheet_matrices.get(s)]
+
+            # ประมวลผลแต่ละชีตขนานกันด้วย process pool - งานต่อชีตเป็น CPU-bound
+            # (parse + regex + อ่านสี) และไม่มี state ข้ามชีต worker แต่ละตัวเปิด
+            # workbook read_only ของตัวเอง ส่วน ID มาใส่เรียงลำดับทีหลังใน process หลัก
+            results_by_sheet = {}
+            max_workers = min(len(data_sheets), os.cpu_count() or 1)
+            if max_workers > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                tasks = [(input_file, s, raw_by_sheet[s], base_name,
+                          max_matrices_count, all_sheet_matrices[s],
+                          thk_rows_by_sheet.get(s)) for s in data_sheets]
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    for s, res in zip(data_sheets, executor.map(_process_sheet_worker, tasks)):
+                        results_by_sheet[s] = res
+            else:
+                # ชีตเดียวไม่คุ้มค่า spawn process - ใช้ workbook ที่เปิดอยู่แล้ว
+                for s in data_sheets:
+                    log.info("\n🔍 ประมวลผล Sheet: %s", s)
+                    results_by_sheet[s] = self.process_sheet(
+                        raw_by_sheet[s], wb[s], s, base_name,
+                        max_matrices_count, all_sheet_matrices[s],
+                        thk_rows_by_sheet.get(s))
+
+            for sheet in wb.sheetnames:
                 # ตรวจสอบ Sheet สารบัญ
                 if sheet.strip().lower() == "สารบัญ":
                     skipped_sheets.append({"sheet": sheet, "reason": "ข้าม Sheet สารบัญ"})
-                    print(f"   ⚠️ ข้าม Sheet: {sheet} (สารบัญ)")
+                    log.info("   ⚠️ ข้าม Sheet: %s (สารบัญ)", sheet)
                     continue
-                
-                print(f"\n🔍 ประมวลผล Sheet: {sheet}")
-                
+
                 # ใช้ข้อมูลจากการสแกน
                 available_matrices = all_sheet_matrices.get(sheet, [])
                 if not available_matrices:
                     error_msg = "ไม่พบ matrix ใดๆ"
-                    print(f"   ❌ {error_msg} ใน {sheet}")
-                    skipped_sheets.append({"sheet": sheet, "reason": error_msg})
-                    continue
-                
-                raw = pd.read_excel(xls, sheet_name=sheet, header=None, engine="openpyxl")
-                ws = wb[sheet]
-                
-                # Find Glass_QTY and Description
-                sheet_glass_qty = 1
-                sheet_description = ""
-                
-                for r in range(raw.shape[0]):
-                    for c in range(raw.shape[1] - 1):
-                        if raw.iat[r, c] is None:
-                            continue
-                        cell = str(raw.iat[r, c]).strip()
-                        low = cell.lower()
-                        
-                        if low in ("glass_qty", "glass qty"):
-                            next_cell = raw.iat[r, c + 1]
-                            qty = self.to_number(next_cell)
-                            if qty is not None:
-                                sheet_glass_qty = qty
-                            
-                        elif low == "description":
-                            desc = raw.iat[r, c + 1]
-                            if desc is not None:
-                                sheet_description = str(desc).strip()
-                
-                # Find main matrix (1 or h/w header)
-                hr, hc = self.find_main_matrix(ws, raw)
-                
-                if hr is None or hc is None:
-                    error_msg = "ไม่พบ main matrix"
-                    print(f"   ❌ {error_msg} ใน {sheet}")
+                    log.info("   ❌ %s ใน %s", error_msg, sheet)
                     skipped_sheets.append({"sheet": sheet, "reason": error_msg})
                     continue
-                
-                # Read widths and heights from main matrix
-                widths = []
-                for c in range(hc + 1, raw.shape[1]):
-                    v = self.to_number(raw.iat[hr, c])
-                    if v is None:
-                        break
-                    widths.append(v)
-                
-                heights = []
-                for r in range(hr + 1, raw.shape[0]):
-                    h_val = self.to_number(raw.iat[r, hc])
-                    if h_val is None:
-                        break
-                    heights.append(h_val)
-                
-                if not widths or not heights:
-                    error_msg = "ไม่พบ dimensions (ความกว้าง/ความสูง)"
-                    print(f"   ❌ {error_msg} ใน {sheet}")
-                    skipped_sheets.append({"sheet": sheet, "reason": error_msg})
+
+                result = results_by_sheet[sheet]
+                if result["skip_reason"]:
+                    skipped_sheets.append({"sheet": sheet, "reason": result["skip_reason"]})
                     continue
-                
-                print(f"   📊 Dimensions: {len(heights)} heights x {len(widths)} widths")
-                print(f"   🎯 Matrices ในชีตนี้: {available_matrices}")
-                
-                # อ่านสีจาก matrices ที่มี
-                matrix_colors = {}
-                
-                # อ่าน matrix 1 (main matrix)
-                if 1 in available_matrices:
-                    matrix_colors[1] = self.read_color_matrix(ws, raw, hr, hc, widths, heights)
-                    print(f"   🎨 1 (main matrix): {len(matrix_colors[1])} colors")
-                
-                # อ่าน matrices อื่นๆ
-                for thickness in available_matrices:
-                    if thickness == 1:
-                        continue  # ข้าม matrix 1 เพราะอ่านไปแล้ว
-                    
-                    hr_thick = self.find_thickness_matrix_in_column_a(ws, raw, thickness)
-                    if hr_thick is not None:
-                        colors = self.read_color_matrix_with_thickness_row(
-                            ws, raw, hr, hc, hr_thick, widths, heights, f"{thickness}"
-                        )
-                        matrix_colors[thickness] = colors
-                        print(f"   🎨 {thickness}: {len(colors)} colors อ่านได้")
-                
-                # Create Type record
-                type_rows.append({
-                    "ID": type_id,
-                    "Serie": base_name,
-                    "Type": sheet.strip(),
-                    "Description": sheet_description,
-                    "width_min": min(widths),
-                    "width_max": max(widths),
-                    "height_min": min(heights),
-                    "height_max": max(heights),
-                })
+
+                # รวมผลจาก worker - ใส่ ID เรียงลำดับที่ process หลักเพื่อให้ deterministic
+                # แล้ว stream ลงไฟล์ทันที ไม่เก็บสะสมใน RAM
+                type_ws.write_row(type_id, 0, (type_id, *result["type_row"].values()))
                 type_id += 1
-                
-                # Create Price records with consistent columns
-                sheet_price_count = 0
-                for i_h, h in enumerate(heights):
-                    for i_w, w in enumerate(widths):
-                        # อ่านราคาจาก main matrix (1)
-                        raw_price = raw.iat[hr + 1 + i_h, hc + 1 + i_w]
-                        p = self.to_number(raw_price)
-                        if p is None:
-                            continue
-                        
-                        # สร้าง price record พร้อมคอลัมน์ตามมาตรฐาน
-                        price_record = {
-                            "ID": price_id,
-                            "Serie": base_name,
-                            "Type": sheet.strip(),
-                            "Width": w,
-                            "Height": h,
-                            "Price": p,
-                            "Glass_QTY": sheet_glass_qty,
-                        }
-                        
-                        # เพิ่มคอลัมน์สีทุกคอลัมน์ตามมาตรฐาน (เติม FFFFFF ถ้าไม่มี)
-                        for i in range(1, max_matrices_count + 1):
-                            color_key = f"{i}_Color"
-                            if i in matrix_colors:
-                                color_value = matrix_colors[i].get((h, w), "FFFFFF")
-                            else:
-                                color_value = "FFFFFF"  # ไม่มี matrix นี้ในชีตนี้
-                            price_record[color_key] = color_value
-                        
-                        price_rows.append(price_record)
-                        price_id += 1
-                        sheet_price_count += 1
-                
+
+                cols = result["price_cols"]
+                for rec in zip(cols["Serie"], cols["Type"], cols["Width"], cols["Height"],
+                               cols["Price"], cols["Glass_QTY"],
+                               *(cols[c] for c in matrix_columns)):
+                    price_ws.write_row(price_id, 0, (price_id, *rec))
+                    price_id += 1
+
                 processed_sheets += 1
-                print(f"   ✅ สร้าง {sheet_price_count} price records สำหรับ {sheet}")
-            
-            # Ensure output directory exists
-            output_path = Path(output_dir)
-            output_path.mkdir(exist_ok=True)
-            
-            # Save output files
-            price_file = output_path / f"Price_{self.job_id}.xlsx"
-            type_file = output_path / f"Type_{self.job_id}.xlsx"
-            
-            pd.DataFrame(price_rows).to_excel(price_file, index=False)
-            pd.DataFrame(type_rows).to_excel(type_file, index=False)
-            
-            print(f"\n✅ เสร็จสิ้น: {len(price_rows)} price records, {len(type_rows)} type records")
-            print(f"📋 คอลัมน์ที่สร้าง: {matrix_columns}")
+
+            wb.close()
+            price_wb.close()
+            type_wb.close()
+
+            total_price_records = price_id - 1
+            log.info("\n✅ เสร็จสิ้น: %d price records, %d type records", total_price_records, type_id - 1)
+            log.info("📋 คอลัมน์ที่สร้าง: %s", matrix_columns)
             
             return {
                 "price_file": str(price_file),
                 "type_file": str(type_file),
-                "total_records": len(price_rows),
+                "total_records": total_price_records,
                 "processed_sheets": processed_sheets,
                 "skipped_sheets": skipped_sheets,
                 "warnings": warnings
             }
             
         except Exception as e:
-            print(f"❌ Error: {str(e)}")
+            log.error("❌ Error: %s", e)
             raise Exception(f"Processing failed: {str(e)}")
 
+def _process_sheet_worker(args):
+    """งานต่อชีตสำหรับ process pool - worker เปิด workbook read_only ของตัวเอง"""
+    (input_file, sheet, raw, base_name,
+     max_matrices_count, available_matrices, thickness_rows) = args
+    log.info("\n🔍 ประมวลผล Sheet: %s", sheet)
+    extractor = ColorExtractor("")
+    wb = load_workbook(input_file, data_only=True, read_only=True, keep_links=False)
+    try:
+        return extractor.process_sheet(raw, wb[sheet], sheet, base_name,
+                                       max_matrices_count, available_matrices,
+                                       thickness_rows)
+    finally:
+        wb.close()
+
 def main():
     """Main function to handle command line arguments"""
     parser = argparse.ArgumentParser(description='Excel Color Extractor - Matrix Mode')
@@ -504,9 +706,14 @@ def main():
     parser.add_argument('--job-id', required=True, help='Job ID for output files')
     parser.add_argument('--output-dir', default='outputs', help='Output directory')
     parser.add_argument('--original-filename', help='Original filename for base name extraction')
+    parser.add_argument('--verbose', action='store_true', help='Show progress logs (stderr)')
     
     args = parser.parse_args()
     
+    # log ไป stderr เสมอ - stdout สงวนไว้ให้ JSON บรรทัดสุดท้ายที่ server.py parse
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(message)s')
+    
     try:
         # Validate input file
         if not os.path.exists(args.input):
@@ -515,12 +722,12 @@ def main():
         if not args.input.lower().endswith('.xlsx'):
             raise ValueError("Input file must be an .xlsx file")
         
-        print(f"🚀 Starting Excel Color Extractor...")
-        print(f"📄 Input file: {args.input}")
-        print(f"🆔 Job ID: {args.job_id}")
-        print(f"📁 Output directory: {args.output_dir}")
+        log.info("🚀 Starting Excel Color Extractor...")
+        log.info("📄 Input file: %s", args.input)
+        log.info("🆔 Job ID: %s", args.job_id)
+        log.info("📁 Output directory: %s", args.output_dir)
         if args.original_filename:
-            print(f"📝 Original filename: {args.original_filename}")
+            log.info("📝 Original filename: %s", args.original_filename)
         
         # Process the file
         extractor = ColorExtractor(args.job_id)
@@ -534,9 +741,8 @@ def main():
         print(json.dumps(result))
         
     except Exception as e:
-        print(f"❌ Error: {str(e)}", file=sys.stderr)
+        log.error("❌ Error: %s", e)
         exit(1)
 
 if __name__ == "__main__":
-    import sys
     main()
\ No newline at end of file
@@ -15,6 +15,14 @@ from werkzeug.utils import secure_filename
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Pre-compiled filename patterns - compile ครั้งเดียวตอน import แทนการ compile ซ้ำทุกไฟล์
+# ลบ timestamp pattern (YYYYMMDD_HHMMSS_)
+_TIMESTAMP_RE = re.compile(r'^\d{8}_\d{6}_[a-f0-9]{8}_')
+# ลบ UUID pattern (8-4-4-4-12 characters)
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_')
+# ลบ job_id pattern ที่อาจมี
+_JOB_ID_RE = re.compile(r'^[a-f0-9]{8}_')
+
 class ExcelProcessor:
     def __init__(self, input_file: str, original_filename: str = None):
         self.input_file = input_file
@@ -31,7 +39,9 @@ class ExcelProcessor:
         
         # Cache for optimized reading
         self._wb = None
+        self._xls = None
         self._sheets_cache = {}
+        self._sheet_colors_cache = {}
     
     def extract_series_from_filename(self) -> str:
         """ดึงชื่อ series จากชื่อไฟล์ โดยจัดการกับ UUID และ timestamp"""
@@ -42,17 +52,10 @@ class ExcelProcessor:
             # ใช้ชื่อไฟล์ปัจจุบัน
             base_name = os.path.splitext(os.path.basename(self.input_file))[0]
         
-        # ลบ timestamp pattern (YYYYMMDD_HHMMSS_)
-        timestamp_pattern = r'^\d{8}_\d{6}_[a-f0-9]{8}_'
-        base_name = re.sub(timestamp_pattern, '', base_name)
-        
-        # ลบ UUID pattern (8-4-4-4-12 characters)
-        uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_'
-        base_name = re.sub(uuid_pattern, '', base_name)
-        
-        # ลบ job_id pattern ที่อาจมี
-        job_id_pattern = r'^[a-f0-9]{8}_'
-        base_name = re.sub(job_id_pattern, '', base_name)
+        # ลบ timestamp / UUID / job_id prefix ด้วย pattern ที่ compile ไว้แล้ว
+        base_name = _TIMESTAMP_RE.sub('', base_name)
+        base_name = _UUID_RE.sub('', base_name)
+        base_name = _JOB_ID_RE.sub('', base_name)
         
         # ลบ prefix/suffix ที่ไม่ต้องการ
         suffixes_to_remove = ['_data', '_price', '_export', '_backup', '_processed']
@@ -94,17 +97,23 @@ class ExcelProcessor:
             )
         return self._wb
     
+    def get_excel_file(self):
+        """Get cached pd.ExcelFile - เปิด/แตก zip ของไฟล์แค่ครั้งเดียวต่อ instance"""
+        if self._xls is None:
+            self._xls = pd.ExcelFile(self.input_file, engine='openpyxl')
+        return self._xls
+
     def read_sheet_optimized(self, sheet_name_or_index, **kwargs):
         """Read sheet with optimized pandas settings"""
         cache_key = f"{sheet_name_or_index}_{str(kwargs)}"
         if cache_key not in self._sheets_cache:
             logger.info(f"Loading sheet: {sheet_name_or_index}")
-            
-            # Use pandas default engine (openpyxl) without conflicting parameters
+
+            # อ่านผ่าน ExcelFile ที่ cache ไว้ - xlsx เป็น zip ของ XML การเปิดจาก
+            # path ใหม่ทุกครั้งทำให้ decompress ทุกชีตซ้ำโดยไม่จำเป็น
             self._sheets_cache[cache_key] = pd.read_excel(
-                self.input_file,
+                self.get_excel_file(),
                 sheet_name=sheet_name_or_index,
-                engine='openpyxl',
                 **kwargs
             )
         return self._sheets_cache[cache_key]
@@ -176,28 +185,36 @@ class ExcelProcessor:
         df.columns = pd.MultiIndex.from_tuples(clean_cols)
         return df
     
+    def _get_sheet_colors(self, sheet_name: str) -> Dict[Tuple[int, int], str]:
+        """อ่านสี background ทั้งชีตใน pass เดียวแล้ว cache เป็น dict
+
+        ws.cell() บน read-only workbook ต้อง stream XML ใหม่ตั้งแต่ต้นชีตทุกครั้ง
+        การเรียกทีละเซลล์ต่อแถวข้อมูลจึงกลายเป็น O(rows^2) - สแกนด้วย iter_rows
+        ครั้งเดียวแล้วเก็บเฉพาะเซลล์ที่มีสี (นอกนั้นถือเป็น FFFFFF)
+        """
+        colors = self._sheet_colors_cache.get(sheet_name)
+        if colors is None:
+            wb = self.get_optimized_workbook()
+            ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.active
+            colors = {}
+            for r, row_cells in enumerate(ws.iter_rows(), start=1):
+                for c, cell in enumerate(row_cells, start=1):
+                    fill = cell.fill
+                    if fill and fill.start_color and fill.start_color.rgb:
+                        color = str(fill.start_color.rgb)
+                        # Remove 'FF' prefix if present (alpha channel)
+                        if len(color) == 8 and color.startswith('FF'):
+                            color = color[2:]
+                        if color and color != '00000000' and color != '000000':
+                            colors[(r, c)] = color
+            self._sheet_colors_cache[sheet_name] = colors
+        return colors
+
     def read_cell_background_color_optimized(self, sheet_name: str, row: int, col: int) -> str:
         """Read background color from Excel cell - OPTIMIZED"""
         try:
-            wb = self.get_optimized_workbook()
-            ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.active
-            
             # Use 1-based indexing for openpyxl
-            cell = ws.cell(row=row + 1, column=col + 1)
-            
-            if cell.fill and cell.fill.start_color and cell.fill.start_color.rgb:
-                color = str(cell.fill.start_color.rgb)
-                # Remove 'FF' prefix if present (alpha channel)
-                if len(color) == 8 and color.startswith('FF'):
-                    color = color[2:]
-                
-                # Check for empty colors
-                if color == '00000000' or color == '000000' or not color:
-                    return 'FFFFFF'
-                
-                return color
-            return 'FFFFFF'
-            
+            return self._get_sheet_colors(sheet_name).get((row + 1, col + 1), 'FFFFFF')
         except Exception as e:
             logger.warning(f"Cannot read cell color: {e}")
             return 'FFFFFF'
@@ -355,14 +372,16 @@ class ExcelProcessor:
     
     def save_results(self, job_id: str) -> None:
         """Save processed data to Excel files with simple names"""
+        # เขียนด้วย xlsxwriter แทน openpyxl backend - stream แถวลง XML ตรงๆ
+        # ไม่ต้องสร้าง cell DOM ทั้งไฟล์ (เร็วกว่ามากเมื่อ record เยอะ)
         if self.price_records:
             price_filename = 'Price.xlsx'
-            pd.DataFrame(self.price_records).to_excel(price_filename, index=False)
+            pd.DataFrame(self.price_records).to_excel(price_filename, index=False, engine='xlsxwriter')
             logger.info(f"Saved {len(self.price_records)} price records to {price_filename}")
-        
+
         if self.type_records:
             type_filename = 'Type.xlsx'
-            pd.DataFrame(self.type_records).to_excel(type_filename, index=False)
+            pd.DataFrame(self.type_records).to_excel(type_filename, index=False, engine='xlsxwriter')
             logger.info(f"Saved {len(self.type_records)} type records to {type_filename}")
     
     def process(self, job_id: str) -> bool:
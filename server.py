@@ -1,5 +1,6 @@
 from flask import Flask, request, jsonify, send_file, render_template_string
 import os
+import re
 import subprocess
 import time
 import uuid
@@ -17,34 +18,77 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# ส่ง JSON เป็น UTF-8 ตรงๆ - ข้อความส่วนใหญ่เป็นภาษาไทย การ escape เป็น
+# \uXXXX ทำให้ payload บวมราวเท่าตัวและเสีย CPU escape ทุก response
+app.json.ensure_ascii = False
+
+# ให้ reverse proxy (nginx/apache) ส่งไฟล์ดาวน์โหลดแทน Python worker
+# เปิดด้วย USE_X_SENDFILE=1 - send_file จะตอบแค่ header X-Sendfile
+# แล้ว proxy อ่านไฟล์ส่งเอง worker ไม่ต้องเสีย CPU สตรีม xlsx ทีละ chunk
+app.use_x_sendfile = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25MB
+UPLOAD_BUFFER_SIZE = 1024 * 1024  # เขียนไฟล์อัปโหลดทีละ 1MB - ลด syscall จาก buffer default 16KB
 ALLOWED_EXTENSIONS = {'xlsx', 'pdf'}
 
 BASE_DIR = Path(__file__).resolve().parent
 PYTHON = sys.executable                  # ใช้ python ของ .venv แน่นอน
 
+# path สคริปต์ worker คำนวณครั้งเดียวตอน import - ไม่ต้องสร้าง Path ใหม่ทุก request
+MAIN_PY = str(BASE_DIR / 'main.py')
+MAIN3_PY = str(BASE_DIR / 'main3.py')
+MAIN4_PY = str(BASE_DIR / 'main4.py')
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # -------------------- Helpers --------------------
+def save_upload_atomic(file_storage, dst_path: str) -> None:
+    """บันทึกไฟล์อัปโหลดแบบ atomic - เขียนลง .tmp ก่อนแล้วค่อย os.replace
+
+    ถ้า client ยกเลิกกลางคัน ไฟล์ที่เขียนค้างครึ่งเดียวจะไม่โผล่ที่ path จริง
+    ให้ขั้นตอนถัดไป (subprocess ที่อ่านไฟล์ / cleanup) หยิบไปใช้ผิดๆ
+    """
+    tmp_path = f"{dst_path}.tmp"
+    try:
+        file_storage.save(tmp_path, buffer_size=UPLOAD_BUFFER_SIZE)
+        os.replace(tmp_path, dst_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+_CLEANUP_INTERVAL = 300  # วินาที - กวาดอย่างมากทุก 5 นาที ไม่ใช่ทุก page view
+_last_cleanup = 0.0
+
 def cleanup_old_files(hours: int = 1) -> None:
-    """Clean up files older than `hours` hours"""
+    """Clean up files older than `hours` hours (no-op ถ้าเพิ่งกวาดไปไม่นาน)"""
+    global _last_cleanup
+    current_time = time.time()
+    if current_time - _last_cleanup < _CLEANUP_INTERVAL:
+        return
+    _last_cleanup = current_time
     try:
-        current_time = time.time()
         expire = hours * 3600
         for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
-            if os.path.exists(folder):
-                for filename in os.listdir(folder):
-                    file_path = os.path.join(folder, filename)
-                    if os.path.isfile(file_path):
-                        if current_time - os.path.getctime(file_path) > expire:
-                            os.remove(file_path)
-                            logger.info(f"Cleaned up old file: {file_path}")
+            if not os.path.isdir(folder):
+                continue
+            # scandir ให้ stat ติดมากับ dirent เลย - ไม่ต้อง stat แยกอีกรอบต่อไฟล์
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file() and current_time - entry.stat().st_ctime > expire:
+                            os.remove(entry.path)
+                            logger.info(f"Cleaned up old file: {entry.path}")
+                    except OSError:
+                        continue
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
 
@@ -104,7 +148,7 @@ def process_comparison_with_main_py(source_type: str, source_data: str, source_p
         start_time = time.time()
 
         # ตรวจสอบว่า main.py มีอยู่หรือไม่
-        main_py_path = BASE_DIR / 'main.py'
+        main_py_path = MAIN_PY
         logger.info(f"main.py path: {main_py_path}")
         logger.info(f"main.py exists: {os.path.exists(main_py_path)}")
 
@@ -113,11 +157,11 @@ def process_comparison_with_main_py(source_type: str, source_data: str, source_p
 
         if source_type == 'text':
             # Text vs PDF mode - ใช้ main4.py หรือ main.py แบบใหม่ถ้ามี
-            main4_py_path = BASE_DIR / 'main4.py'
+            main4_py_path = MAIN4_PY
             if os.path.exists(main4_py_path):
                 logger.info(f"Processing text vs PDF comparison with main4.py")
                 cmd = [
-                    PYTHON, str(main4_py_path),
+                    PYTHON, main4_py_path,
                     '--mode', 'text_vs_pdf',
                     '--text', source_data,
                     '--target-pdf', target_pdf_path,
@@ -127,7 +171,7 @@ def process_comparison_with_main_py(source_type: str, source_data: str, source_p
                 # ลองใช้ main.py แบบใหม่
                 logger.info(f"Processing text vs PDF comparison with main.py (new format)")
                 cmd = [
-                    PYTHON, str(main_py_path),
+                    PYTHON, main_py_path,
                     '--mode', 'text_vs_pdf',
                     '--text', source_data,
                     '--target-pdf', target_pdf_path,
@@ -135,11 +179,11 @@ def process_comparison_with_main_py(source_type: str, source_data: str, source_p
                 ]
         elif source_type == 'pdf':
             # PDF vs PDF mode - ใช้ main4.py หรือ main.py แบบใหม่ถ้ามี
-            main4_py_path = BASE_DIR / 'main4.py'
+            main4_py_path = MAIN4_PY
             if os.path.exists(main4_py_path):
                 logger.info(f"Processing PDF vs PDF comparison with main4.py")
                 cmd = [
-                    PYTHON, str(main4_py_path),
+                    PYTHON, main4_py_path,
                     '--mode', 'pdf_vs_pdf',
                     '--source-pdf', source_pdf_path,
                     '--target-pdf', target_pdf_path,
@@ -150,7 +194,7 @@ def process_comparison_with_main_py(source_type: str, source_data: str, source_p
                 # ลองใช้ main.py แบบใหม่
                 logger.info(f"Processing PDF vs PDF comparison with main.py (new format)")
                 cmd = [
-                    PYTHON, str(main_py_path),
+                    PYTHON, main_py_path,
                     '--mode', 'pdf_vs_pdf',
                     '--source-pdf', source_pdf_path,
                     '--target-pdf', target_pdf_path,
@@ -211,7 +255,7 @@ def process_matrix_file_with_main_py(input_path: str, job_id: str, original_file
 
         # ลองใช้ main.py แบบใหม่ก่อน (ถ้ารองรับ --mode)
         cmd_new = [
-            PYTHON, str(BASE_DIR / 'main.py'),
+            PYTHON, MAIN_PY,
             '--mode', 'matrix',
             '--input', input_path,
             '--job-id', job_id,
@@ -222,7 +266,7 @@ def process_matrix_file_with_main_py(input_path: str, job_id: str, original_file
 
         # ลองใช้ main.py แบบเดิม (legacy format)
         cmd_legacy = [
-            PYTHON, str(BASE_DIR / 'main.py'),
+            PYTHON, MAIN_PY,
             '--input', input_path,
             '--job-id', job_id,
             '--output-dir', OUTPUT_FOLDER
@@ -295,7 +339,7 @@ def process_joint_file_with_main_py(input_path: str, job_id: str):
         start_time = time.time()
 
         cmd = [
-            PYTHON, str(BASE_DIR / 'main.py'),
+            PYTHON, MAIN_PY,
             '--mode', 'joint',
             '--input', input_path,
             '--job-id', job_id,
@@ -381,15 +425,15 @@ def process_pdf_file_with_main_py(input_path: str, start_page: int, job_id: str)
         start_time = time.time()
 
         # ใช้ main3.py ถ้ามี (ไม่เปลี่ยนแปลง)
-        main3_py_path = BASE_DIR / 'main3.py'
+        main3_py_path = MAIN3_PY
         if os.path.exists(main3_py_path):
             logger.info(f"Processing PDF file with main3.py")
-            cmd = [PYTHON, str(main3_py_path), input_path, str(start_page), job_id]
+            cmd = [PYTHON, main3_py_path, input_path, str(start_page), job_id]
         else:
             # ใช้ main.py แบบใหม่
             logger.info(f"Processing PDF file with main.py (new format)")
             cmd = [
-                PYTHON, str(BASE_DIR / 'main.py'),
+                PYTHON, MAIN_PY,
                 '--mode', 'format',
                 '--input', input_path,
                 '--start-page', str(start_page),
@@ -509,7 +553,7 @@ def compare_files():
         target_pdf_path = os.path.join(UPLOAD_FOLDER, f'{job_id}_target_{target_filename}')
         
         logger.info(f"Saving target PDF to: {target_pdf_path}")
-        pdf_file.save(target_pdf_path)
+        save_upload_atomic(pdf_file, target_pdf_path)
         
         # ตรวจสอบว่าไฟล์ถูกบันทึกแล้ว
         if not os.path.exists(target_pdf_path):
@@ -534,7 +578,7 @@ def compare_files():
             source_pdf_path = os.path.join(UPLOAD_FOLDER, f'{job_id}_source_{source_filename}')
             
             logger.info(f"Saving source PDF to: {source_pdf_path}")
-            pdf_source_file.save(source_pdf_path)
+            save_upload_atomic(pdf_source_file, source_pdf_path)
             
             # ตรวจสอบว่าไฟล์ถูกบันทึกแล้ว
             if not os.path.exists(source_pdf_path):
@@ -582,11 +626,11 @@ def process_matrix_file():
 
         filename = secure_filename(file.filename)
         input_path = os.path.join(UPLOAD_FOLDER, f'{job_id}_{filename}')
-        file.save(input_path)
+        save_upload_atomic(file, input_path)
 
         logger.info(f"Processing Matrix file: {filename} with job_id: {job_id}")
 
-        if not os.path.exists(BASE_DIR / 'main.py'):
+        if not os.path.exists(MAIN_PY):
             return jsonify({'message': 'ไม่พบไฟล์ main.py สำหรับ Matrix mode'}), 500
 
         result, error = process_matrix_file_with_main_py(input_path, job_id, file.filename)
@@ -622,11 +666,11 @@ def process_joint_file():
 
         filename = secure_filename(file.filename)
         input_path = os.path.join(UPLOAD_FOLDER, f'{job_id}_{filename}')
-        file.save(input_path)
+        save_upload_atomic(file, input_path)
 
         logger.info(f"Processing Joint file: {filename} with job_id: {job_id}")
 
-        if not os.path.exists(BASE_DIR / 'main.py'):
+        if not os.path.exists(MAIN_PY):
             return jsonify({'message': 'ไม่พบไฟล์ main.py สำหรับ Joint mode'}), 500
 
         result, error = process_joint_file_with_main_py(input_path, job_id)
@@ -664,11 +708,11 @@ def upload_pdf():
 
         filename = secure_filename(file.filename)
         input_path = os.path.join(UPLOAD_FOLDER, f'{job_id}_{filename}')
-        file.save(input_path)
+        save_upload_atomic(file, input_path)
 
         logger.info(f"Processing PDF file: {filename} with job_id: {job_id}, start_page: {start_page}")
 
-        if not os.path.exists(BASE_DIR / 'main.py'):
+        if not os.path.exists(MAIN_PY):
             return jsonify({'error': 'ไม่พบไฟล์ main.py สำหรับ Format mode'}), 500
 
         result, error = process_pdf_file_with_main_py(input_path, start_page, job_id)
@@ -685,56 +729,89 @@ def upload_pdf():
 @app.route('/download/<format>')
 def download_pdf_results(format: str):
     try:
+        # ไม่ probe ด้วย exists() ก่อน - ให้ send_file เปิดไฟล์เลยแล้วจับ
+        # FileNotFoundError แทน ลด stat ซ้ำและปิดช่อง race ระหว่างเช็คกับเปิด
         if format == 'txt':
             txt_file = os.path.join(OUTPUT_FOLDER, 'pdf_results.txt')
-            if not os.path.exists(txt_file):
-                return jsonify({'error': 'ไม่พบไฟล์ผลลัพธ์'}), 404
-            return send_file(txt_file, as_attachment=True, download_name='pdf_extraction_results.txt')
+            # conditional=True เปิด Range/If-Range (RFC 7233) - client ดาวน์โหลดต่อจากที่ค้างได้
+            return send_file(txt_file, as_attachment=True, download_name='pdf_extraction_results.txt',
+                             conditional=True)
         elif format == 'json':
             json_file = os.path.join(OUTPUT_FOLDER, 'pdf_results.json')
-            if not os.path.exists(json_file):
-                return jsonify({'error': 'ไม่พบไฟล์ผลลัพธ์'}), 404
-            return send_file(json_file, as_attachment=True, download_name='pdf_extraction_results.json')
+            return send_file(json_file, as_attachment=True, download_name='pdf_extraction_results.json',
+                             conditional=True)
         else:
             return jsonify({'error': 'รูปแบบไฟล์ไม่ถูกต้อง'}), 400
+    except FileNotFoundError:
+        return jsonify({'error': 'ไม่พบไฟล์ผลลัพธ์'}), 404
     except Exception as e:
         return jsonify({'error': f'เกิดข้อผิดพลาดในการดาวน์โหลด: {str(e)}'}), 500
 
+# ตาราง file_type -> (template ชื่อไฟล์ใน outputs, ชื่อที่ให้ user ดาวน์โหลด)
+_DOWNLOAD_FILES = {
+    'price': ('Price_{}.xlsx', 'Price.xlsx'),
+    'type': ('Type_{}.xlsx', 'Type.xlsx'),
+}
+
+# job_id ที่แจกจริงคือ YYYYMMDD_HHMMSS_ + hex 8 ตัว - ตรวจรูปแบบก่อนแตะดิสก์
+# กัน path traversal และไม่เสีย syscall ให้ traffic มั่วๆ จาก scanner
+_JOB_ID_RE = re.compile(r'\A\d{8}_\d{6}_[0-9a-f]{8}\Z')
+
 @app.route('/api/download/<job_id>/<file_type>')
 def download_file(job_id: str, file_type: str):
     try:
-        if file_type == 'price':
-            filename = f'Price_{job_id}.xlsx'
-        elif file_type == 'type':
-            filename = f'Type_{job_id}.xlsx'
-        else:
+        spec = _DOWNLOAD_FILES.get(file_type)
+        if spec is None:
             return jsonify({'message': 'ประเภทไฟล์ไม่ถูกต้อง'}), 400
-
-        file_path = os.path.join(OUTPUT_FOLDER, filename)
-        if not os.path.exists(file_path):
-            return jsonify({'message': 'ไม่พบไฟล์'}), 404
-
-        download_name = 'Price.xlsx' if file_type == 'price' else 'Type.xlsx'
-        return send_file(
+        if not _JOB_ID_RE.match(job_id):
+            return jsonify({'message': 'job_id ไม่ถูกต้อง'}), 400
+
+        file_path = os.path.join(OUTPUT_FOLDER, spec[0].format(job_id))
+        download_name = spec[1]
+        # conditional=True ให้ werkzeug จัดการ Range/If-Range/ETag (RFC 7233)
+        # เอง - ไฟล์ workbook ใหญ่ๆ ดาวน์โหลดต่อจากจุดที่หลุดได้แทนเริ่มใหม่
+        resp = send_file(
             file_path,
             as_attachment=True,
             download_name=download_name,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            conditional=True
         )
+        # URL ผูกกับ job_id - ไฟล์เดิมไม่มีวันเปลี่ยน bytes ให้ browser/CDN
+        # cache ได้เต็มที่ โหลดซ้ำจะเป็น 304 หรือไม่ยิง request เลย
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 3600
+        resp.cache_control.immutable = True
+        resp.cache_control.no_cache = None
+        return resp
+    except FileNotFoundError:
+        # เปิดไฟล์ตรงๆ แล้วจับ error แทน exists() ก่อนหน้า - stat ครั้งเดียว ไม่มี race
+        return jsonify({'message': 'ไม่พบไฟล์'}), 404
     except Exception as e:
         logger.error(f"Download error: {e}")
         return jsonify({'message': f'เกิดข้อผิดพลาดในการดาวน์โหลด: {str(e)}'}), 500
 
+# cache ผล health check - payload นี้ต้อง spawn subprocess (main.py --help) ต่อครั้ง
+# liveness probe ที่ยิงถี่ๆ ไม่ควรจ่ายราคานั้นทุก hit
+_HEALTH_TTL = 5.0  # วินาที
+_health_cache = None
+_health_cached_at = 0.0
+
 @app.route('/health')
 def health_check():
-    main_py_exists = os.path.exists(BASE_DIR / 'main.py')
+    global _health_cache, _health_cached_at
+    now = time.monotonic()
+    if _health_cache is not None and now - _health_cached_at < _HEALTH_TTL:
+        return jsonify(_health_cache)
+
+    main_py_exists = os.path.exists(MAIN_PY)
     index_html_exists = os.path.exists(BASE_DIR / 'index.html')
     
     # ทดสอบเรียก main.py
     test_result = None
     try:
         if main_py_exists:
-            cmd = [PYTHON, str(BASE_DIR / 'main.py'), '--help']
+            cmd = [PYTHON, MAIN_PY, '--help']
             result = run_subprocess(cmd)
             test_result = {
                 'return_code': result.returncode,
@@ -744,7 +821,7 @@ def health_check():
     except Exception as e:
         test_result = {'error': str(e)}
     
-    return jsonify({
+    payload = {
         'status': 'healthy',
         'current_directory': str(BASE_DIR),
         'python_executable': PYTHON,
@@ -766,20 +843,29 @@ def health_check():
             'joint',
             'format'
         ]
-    })
+    }
+    _health_cache = payload
+    _health_cached_at = now
+    return jsonify(payload)
+
+# body ของ error handler เป็นข้อความตายตัว - สร้าง dict ไว้ครั้งเดียวพอ
+# (jsonify ไม่แก้ dict ที่รับเข้า ใช้ซ้ำข้าม request ได้)
+_ERR_TOO_LARGE = {'error': 'ไฟล์ใหญ่เกินไป (สูงสุด 25MB)'}
+_ERR_NOT_FOUND = {'error': 'ไม่พบหน้าที่ต้องการ'}
+_ERR_INTERNAL = {'error': 'เกิดข้อผิดพลาดภายในเซิร์ฟเวอร์'}
 
 @app.errorhandler(413)
 def too_large(e):
-    return jsonify({'error': 'ไฟล์ใหญ่เกินไป (สูงสุด 25MB)'}), 413
+    return jsonify(_ERR_TOO_LARGE), 413
 
 @app.errorhandler(404)
 def not_found(e):
-    return jsonify({'error': 'ไม่พบหน้าที่ต้องการ'}), 404
+    return jsonify(_ERR_NOT_FOUND), 404
 
 @app.errorhandler(500)
 def internal_error(error):
     logger.exception("Internal server error")
-    return jsonify({'error': 'เกิดข้อผิดพลาดภายในเซิร์ฟเวอร์'}), 500
+    return jsonify(_ERR_INTERNAL), 500
 
 # -------------------- Run --------------------
 if __name__ == '__main__':
@@ -854,4 +940,8 @@ if __name__ == '__main__':
     print("⚠️  Press Ctrl+C to stop the server")
     print("-" * 50)
 
+    # dev server รันโปรเซสเดียว - งาน xlsx กิน CPU จะบล็อก request อื่น
+    # production ให้รันหลาย worker แชร์ uploads/outputs บนดิสก์เดียวกัน:
+    #   gunicorn -w ${WEB_CONCURRENCY:-4} -b 0.0.0.0:5000 server:app
+    # (โฟลเดอร์ถูก makedirs ตอน import แล้ว ทุก worker เห็นตรงกัน)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file